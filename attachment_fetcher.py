@@ -1,16 +1,47 @@
 #!/usr/bin/env python3
 
 import base64
+import binascii
 import datetime
+import email.errors
+import email.header
 import email.utils
+import hashlib
 import imaplib
+import io
+import itertools
 import logging
 import os
+import quopri
 import re
 import ssl
+import urllib.parse
 
 from config_reader import ImapData
 
+# maximum number of UIDs per FETCH command, keeps the request line below common server limits
+FETCH_CHUNK_SIZE = 100
+# maximum size of the attachments downloaded per FETCH command, imaplib keeps the complete response in memory
+FETCH_MAX_BYTES = 8 << 20
+
+# start of a new message in a FETCH response, e.g. b'12 (UID 345 ...'
+_FETCH_START_RE = re.compile(rb'^\d+ \(')
+# UID data item of a FETCH response
+_FETCH_UID_RE = re.compile(rb'[( ]UID (\d+)')
+# section name of a literal in a FETCH response, e.g. b'BODY[HEADER.FIELDS (FROM)] {42}'
+_FETCH_LITERAL_RE = re.compile(rb'(BODY\[[^\]]*\](?:<\d+>)?) \{\d+\}$')
+# size announcement of any other literal, e.g. inside BODYSTRUCTURE
+_LITERAL_SIZE_RE = re.compile(rb'\{\d+\}$')
+# write buffer size for attachments, base64 attachments are decoded in slices of this size.
+# only the encoded attachment is kept in memory completely, not the decoded one
+WRITE_BUFFER_SIZE = 1 << 20
+# all bytes except the base64 alphabet and padding, like line breaks. they are ignored when decoding
+_BASE64_IGNORED = bytes(set(range(256)) - set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="))
+
+# single token of a parenthesized IMAP list: opening/closing parenthesis, quoted string or atom
+_IMAP_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_IMAP_ESCAPE_RE = re.compile(rb'\\(.)')
+
 class AttachmentFetcher:
     def __init__(
             self,
@@ -21,19 +52,43 @@ class AttachmentFetcher:
             allowed_senders: list,              # list of allowed e-mail senders. may include * to allow all
             logger: logging.Logger):            # logger handler/object to log to
 
+        assert isinstance(cache_data_path, str), "cache_data_path must be a path string"
         self.connection = None
         self.imap_data = imap_data
         self.cache_data_path = cache_data_path
         self.cache_info_file = cache_info_file
-        self.allowed_file_extensions = allowed_file_extensions
-        self.allowed_senders = allowed_senders
+        # str.endswith requires a tuple, lookups of senders are faster in a set
+        self.allowed_file_extensions = tuple(extension.lower() for extension in allowed_file_extensions)
+        self.allowed_senders = frozenset(allowed_senders)
         self.logger = logger
+        self.uidvalidity = None     # mailbox state reported by the server when selecting the inbox
+        self.uidnext = None
+        self.message_count = None
+        self._cache_info = None     # file names in the cache folder, read once per update
 
     def run(self) -> bool:
         """ Connect to mailserver and fetch new attachments, if available. """
         new_attachments = self._update_cache()
         return new_attachments
 
+    def connect(self) -> imaplib.IMAP4:
+        """ Login to mailserver, unless already connected, and select the inbox. Returns the connection."""
+        if self.connection is None:
+            self._open_connection()
+        if self.connection is not None:
+            self._select_inbox()
+        return self.connection
+
+    def disconnect(self):
+        """ Logout from mailserver, if connected."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.logout()
+        except Exception as e:
+            self.logger.warning("Logout from {} failed (error: {}).".format(self.imap_data.host, str(e)))
+        self.connection = None
+
     #############################################
     # private functions of AttachmentFetcher
     #############################################
@@ -46,17 +101,26 @@ class AttachmentFetcher:
     def _get_files_in_folder(self, folder_path: str) -> list:
         if not os.path.isdir(folder_path):
             return []
-        folder_entries = os.listdir(folder_path)
-        folder_matches = [f for f in folder_entries if os.path.isfile(os.path.join(folder_path, f))]
+        # scandir provides the file type from the directory listing (d_type), no stat call per entry needed.
+        # not following symlinks keeps it that way and lists regular files only, as downloaded
+        with os.scandir(folder_path) as folder_entries:
+            folder_matches = [entry.name for entry in folder_entries if entry.is_file(follow_symlinks=False)]
         return folder_matches
 
     def _get_cache(self):
+        if self._cache_info is not None:
+            return self._cache_info
         if not os.path.isdir(self.cache_data_path):
             self.logger.info("Cache folder {} does not exist.. creating it.".format(self.cache_data_path))
             os.makedirs(self.cache_data_path)
-        cache_info = self._get_files_in_folder(self.cache_data_path)
-        self.logger.info("Found {} files in cache {}".format(len(cache_info), self.cache_data_path))
-        return cache_info
+        self._cache_info = self._get_files_in_folder(self.cache_data_path)
+        self.logger.info("Found {} files in cache {}".format(len(self._cache_info), self.cache_data_path))
+        return self._cache_info
+
+    def _add_to_cache(self, file_name: str):
+        cache_info = self._get_cache()
+        if file_name not in cache_info:
+            cache_info.append(file_name)
 
     def _open_connection(self):
         try:
@@ -83,118 +147,444 @@ class AttachmentFetcher:
 
     def _select_inbox(self):
         try:
-            response_code, _ = self.connection.select('INBOX')
+            response_code, message_count = self.connection.select('INBOX')
             if response_code != "OK":
                 self.logger.error("Selecting INBOX failed. Response code: " + response_code + "\nResetting connection.")
                 self.connection = None
+                return
+            # SELECT reports the mailbox state as untagged responses, e.g. "* OK [UIDNEXT 4392]"
+            _, uidvalidity = self.connection.response('UIDVALIDITY')
+            _, uidnext = self.connection.response('UIDNEXT')
+            self.uidvalidity = uidvalidity[0].decode("ascii") if uidvalidity[0] else None
+            self.uidnext = uidnext[0].decode("ascii") if uidnext[0] else None
+            self.message_count = int(message_count[0]) if message_count[0] and message_count[0].isdigit() else None
         except Exception as e:
             self.logger.error("Selecting INBOX failed (error: " + str(e) + "). Resetting connection.")
             self.connection = None
 
     @staticmethod
-    def _unique_attachment_name(email_datetime: datetime.datetime, email_sender: str, attachment_name: str):
-        email_sender_encoded = base64.urlsafe_b64encode(email_sender.encode('ascii')).decode('ascii')
-        filename_encoded = base64.urlsafe_b64encode(attachment_name.encode('ascii')).decode('ascii')
-        return "__".join([email_datetime.strftime("%Y-%m-%d_%H-%M-%S"), email_sender_encoded, filename_encoded])
+    def _encode_name_part(name: str) -> str:
+        return base64.urlsafe_b64encode(name.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _unique_attachment_name(email_datetime_string: str, email_sender_encoded: str, attachment_name: str):
+        """ Date and sender are the same for all attachments of an e-mail, they are formatted/encoded once
+        by the caller (see _mail_info)."""
+        filename_encoded = AttachmentFetcher._encode_name_part(attachment_name)
+        return "__".join([email_datetime_string, email_sender_encoded, filename_encoded])
+
+    @staticmethod
+    def _chunks(items: list, chunk_size: int):
+        """ Yield successive lists of at most chunk_size entries of items."""
+        iterator = iter(items)
+        chunk = list(itertools.islice(iterator, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(iterator, chunk_size))
+
+    @staticmethod
+    def _chunks_by_size(items: list, item_sizes: list, max_size: int, chunk_size: int):
+        """ Yield successive lists of at most chunk_size entries of items, with a total size of at most max_size.
+        An item larger than max_size is yielded on its own."""
+        chunk = []
+        chunk_total = 0
+        for item, item_size in zip(items, item_sizes):
+            if chunk and (len(chunk) >= chunk_size or chunk_total + item_size > max_size):
+                yield chunk
+                chunk = []
+                chunk_total = 0
+            chunk.append(item)
+            chunk_total += item_size
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _split_fetch_response(data: list) -> list:
+        """ Group the raw data of a (UID) FETCH response by message.
+        Returns a list of (uid, attributes, literals) tuples: attributes contains the non-literal part of the
+        response, literals maps the section names (e.g. b'BODY[2]') to the corresponding literal data."""
+        messages = []
+        for entry in data:
+            line, literal = entry if isinstance(entry, tuple) else (entry, None)
+            if line is None:
+                continue
+            if _FETCH_START_RE.match(line):
+                messages.append([b"", {}])
+            if not messages:
+                continue
+            attributes, literals = messages[-1]
+            if literal is None:
+                messages[-1][0] = attributes + line
+                continue
+            section = _FETCH_LITERAL_RE.search(line)
+            if section is not None:
+                literals[section.group(1)] = literal
+                messages[-1][0] = attributes + line[:section.start()]
+            else:
+                # literal as part of another data item: keep it inline as quoted string
+                quoted = literal.replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+                messages[-1][0] = attributes + _LITERAL_SIZE_RE.sub(b"", line) + b'"' + quoted + b'"'
+
+        fetch_items = []
+        for attributes, literals in messages:
+            uid = _FETCH_UID_RE.search(attributes)
+            if uid is not None:
+                fetch_items.append((uid.group(1), attributes, literals))
+        return fetch_items
+
+    @staticmethod
+    def _parse_imap_list(data: bytes, pos: int = 0):
+        """ Parse the parenthesized IMAP list starting at data[pos] into nested lists of bytes (NIL as None).
+        Returns the parsed list and the position after it."""
+        stack = []
+        while True:
+            token = _IMAP_TOKEN_RE.match(data, pos)
+            if token is None:
+                raise ValueError("Malformed IMAP list at position {}".format(pos))
+            pos = token.end()
+            opening, closing, quoted, atom = token.groups()
+            if opening:
+                stack.append([])
+                continue
+            if not stack:
+                raise ValueError("IMAP list expected at position {}".format(token.start()))
+            if closing:
+                finished = stack.pop()
+                if not stack:
+                    return finished, pos
+                stack[-1].append(finished)
+            elif quoted is not None:
+                stack[-1].append(_IMAP_ESCAPE_RE.sub(rb'\1', quoted))
+            else:
+                stack[-1].append(None if atom.upper() == b"NIL" else atom)
+
+    @staticmethod
+    def _parameter(parameters: list, name: bytes):
+        """ Value of a parameter in a BODYSTRUCTURE parameter list ("key" "value" ...), None if not found."""
+        if not isinstance(parameters, list):
+            return None
+        for key, value in zip(parameters[0::2], parameters[1::2]):
+            if isinstance(key, bytes) and key.lower() == name:
+                return value
+        return None
+
+    @staticmethod
+    def _decode_header_value(value: bytes) -> str:
+        """ Decode a file name as sent by the server. It may contain RFC 2047 encoded words (=?utf-8?b?...?=)."""
+        text = value.decode("utf-8", errors="replace")
+        try:
+            return str(email.header.make_header(email.header.decode_header(text)))
+        except (email.errors.HeaderParseError, LookupError, UnicodeDecodeError):
+            return text
+
+    @staticmethod
+    def _attachment_parts(body_structure: list, section: str = "") -> list:
+        """ Find all parts with a content disposition and file name in a parsed BODYSTRUCTURE, including the parts
+        of attached e-mails.
+        Returns list of (section, file name, transfer encoding, encoded size) tuples, section as used in BODY[section]."""
+        if body_structure and isinstance(body_structure[0], list):
+            # multipart: list of body parts, followed by subtype and extension data
+            attachment_parts = []
+            body_parts = itertools.takewhile(lambda entry: isinstance(entry, list), body_structure)
+            for number, body_part in enumerate(body_parts, start=1):
+                part_section = "{}.{}".format(section, number) if section else str(number)
+                attachment_parts += AttachmentFetcher._attachment_parts(body_part, part_section)
+            return attachment_parts
+
+        # single part: type, subtype, parameters, id, description, encoding, size, <type specific fields>,
+        # md5, disposition, ... (text parts add the number of lines, message/rfc822 envelope, body and lines)
+        if len(body_structure) < 7 or not isinstance(body_structure[0], bytes):
+            return []
+        content_type = (body_structure[0] + b"/" + (body_structure[1] or b"")).lower()
+        part_section = section if section else "1"
+        attachment_parts = []
+        disposition_index = 8
+        if content_type.startswith(b"text/"):
+            disposition_index += 1
+        elif content_type == b"message/rfc822":
+            disposition_index += 3
+            # attached (e.g. forwarded) e-mail: its parts are numbered below the section of this part, e.g. 3.1, 3.2.
+            # a single part body of the attached e-mail is section 3.1
+            nested_body = body_structure[8] if len(body_structure) > 8 else None
+            if isinstance(nested_body, list) and nested_body:
+                nested_section = part_section if isinstance(nested_body[0], list) else part_section + ".1"
+                attachment_parts += AttachmentFetcher._attachment_parts(nested_body, nested_section)
+        if len(body_structure) <= disposition_index or not isinstance(body_structure[disposition_index], list):
+            return attachment_parts
+
+        disposition = body_structure[disposition_index]
+        disposition_parameters = disposition[1] if len(disposition) > 1 else None
+        file_name = AttachmentFetcher._parameter(disposition_parameters, b"filename")
+        if file_name is None:
+            file_name = AttachmentFetcher._parameter(body_structure[2], b"name")
+        if file_name is not None:
+            file_name = AttachmentFetcher._decode_header_value(file_name)
+        else:
+            # RFC 2231 parameter, e.g. filename*=utf-8''%C3%A4pfel.jpg
+            file_name = AttachmentFetcher._parameter(disposition_parameters, b"filename*")
+            if file_name is None:
+                return attachment_parts
+            charset, _, file_name = email.utils.decode_rfc2231(file_name.decode("ascii", errors="replace"))
+            try:
+                file_name = urllib.parse.unquote(file_name, encoding=charset or "utf-8", errors="replace")
+            except LookupError:
+                file_name = urllib.parse.unquote(file_name, errors="replace")
+        encoding = (body_structure[5] or b"7bit").decode("ascii", errors="replace").lower()
+        size = int(body_structure[6]) if isinstance(body_structure[6], bytes) and body_structure[6].isdigit() else 0
+        return [(part_section, file_name, encoding, size)] + attachment_parts
 
-    def _mail_info(self, uid):
+    def _mail_info(self, uid: bytes, attributes: bytes, literals: dict):
         mail_info = []
+        # the response may contain other FETCH items too, e.g. unsolicited flag updates: skip them
+        internal_date = imaplib.Internaldate2tuple(attributes)
+        body_structure_start = attributes.find(b"BODYSTRUCTURE ")
+        if internal_date is None or body_structure_start < 0:
+            self.logger.debug("Skipping FETCH item without INTERNALDATE or BODYSTRUCTURE for e-mail {}".format(uid))
+            return mail_info
         # email internal date-time
-        _, internal_date = self.connection.fetch(uid, '(INTERNALDATE)')
-        email_datetime = datetime.datetime(*imaplib.Internaldate2tuple(internal_date[0])[:6])
+        email_datetime = datetime.datetime(*internal_date[:6])
         # get sender
-        _, field_from = self.connection.fetch(uid, '(BODY[HEADER.FIELDS (FROM)])')
-        email_from = email.utils.parseaddr(field_from[0][1].decode("utf-8"))[1]
-        # attachment names
-        _, body_structure = self.connection.fetch(uid, '(BODYSTRUCTURE)')
-        attachment_names = re.findall("\"filename\" \"(.+?)\"", body_structure[0].decode("utf-8"))
+        field_from = next((value for key, value in literals.items() if key.startswith(b"BODY[HEADER")), b"")
+        email_from = email.utils.parseaddr(field_from.decode("utf-8", errors="replace"))[1]
+        # attachment sections, names and encodings
+        try:
+            body_structure, _ = self._parse_imap_list(attributes, body_structure_start + len(b"BODYSTRUCTURE "))
+        except ValueError as e:
+            self.logger.error("Could not parse BODYSTRUCTURE of e-mail {} (error: {})".format(uid, str(e)))
+            return mail_info
+
+        # same for all attachments of this e-mail
+        email_datetime_string = email_datetime.strftime("%Y-%m-%d_%H-%M-%S")
+        email_from_encoded = self._encode_name_part(email_from)
+        valid_sender = self._is_valid_sender(email_from)
 
-        for attachment_name in attachment_names:
+        for section, attachment_name, encoding, size in self._attachment_parts(body_structure):
             email_data = {
                 "email_uid": uid,
                 "email_datetime": email_datetime,
                 "email_from": email_from,
                 "attachment_name": attachment_name,
-                "mangled_name": self._unique_attachment_name(email_datetime, email_from, attachment_name)}
+                "section": section,
+                "encoding": encoding,
+                "size": size,
+                "mangled_name": self._unique_attachment_name(email_datetime_string, email_from_encoded, attachment_name)}
 
-            if self._is_valid_file(attachment_name) and self._is_valid_sender(email_from):
+            if valid_sender and self._is_valid_file(attachment_name):
                 mail_info.append(email_data)
         
         return mail_info
 
-    def _search_all(self):
-        """ Searches all e-mails for matching criteria (file type, sender), returns list of all matches."""
+    def _fetch_mail_info_set(self, uid_set: bytes):
+        """ Fetch date, sender and body structure of all e-mails in the uid set (e.g. b'3,5,8' or b'12:*')."""
+        mail_infos = []
+        response_code, data = self.connection.uid(
+            'FETCH', uid_set, '(INTERNALDATE BODY.PEEK[HEADER.FIELDS (FROM)] BODYSTRUCTURE)')
+        if response_code != "OK":
+            raise imaplib.IMAP4.error("Fetching info of E-Mails {} failed.".format(uid_set.decode("ascii")))
+        for uid, attributes, literals in self._split_fetch_response(data):
+            mail_infos += self._mail_info(uid, attributes, literals)
+        return mail_infos
+
+    def _fetch_mail_infos(self, uids: list):
+        """ Fetch date, sender and body structure of the given e-mails in bulk, returns list of all matches."""
         mail_infos = []
+        for uid_chunk in self._chunks(uids, FETCH_CHUNK_SIZE):
+            mail_infos += self._fetch_mail_info_set(b",".join(uid_chunk))
+        return mail_infos
+
+    def _sender_criteria(self) -> list:
+        """ SEARCH criteria matching any of the allowed senders. Empty, if all senders are allowed."""
+        if "*" in self.allowed_senders:
+            return []
+        criteria = ['FROM "{}"'.format(sender.replace("\\", "\\\\").replace('"', '\\"')) for sender in sorted(self.allowed_senders)]
+        # search keys are combined by AND. multiple senders need the prefix notation OR OR a b c
+        return ['OR'] * (len(criteria) - 1) + criteria
+
+    def _search_all(self, first_uid: int = 1):
+        """ Searches all e-mails starting from UID first_uid for matching criteria (file type, sender).
+        If all senders are allowed, the info is fetched for the UID range directly, without a SEARCH.
+        Returns list of all matches, or None if searching failed."""
         try:
-            response_code, matches = self.connection.search(None, 'ALL')
+            # imaplib waits for every response, so avoid round trips where possible:
+            # nothing to do if no e-mail was received since the last update or the inbox is empty
+            if self.message_count == 0 or (self.uidnext is not None and first_uid >= int(self.uidnext)):
+                return []
+            sender_criteria = self._sender_criteria()
+            if not sender_criteria:
+                # "n:*" always includes the latest e-mail, even if its UID is lower than n
+                mail_infos = self._fetch_mail_info_set("{}:*".format(first_uid).encode("ascii"))
+                return [entry for entry in mail_infos if int(entry["email_uid"]) >= first_uid]
+
+            criteria = [] if first_uid <= 1 else ['UID', '{}:*'.format(first_uid)]
+            # let the server filter by sender. FROM matches substrings, so senders are still checked exactly later on
+            criteria += sender_criteria
+            response_code, matches = self.connection.uid('SEARCH', None, *criteria)
             if response_code != "OK":
                 self.logger.error("Search for E-Mails failed.")
-                return mail_infos
+                return None
 
             # found matches. Extract mail info and return it
-            for uid in matches[0].split():
-                mail_infos += self._mail_info(uid)
-
-            return mail_infos
+            uids = [uid for uid in matches[0].split() if int(uid) >= first_uid]
+            return self._fetch_mail_infos(uids)
 
         except Exception as e:
-            self.logger.error("Searching INBOX failed. Resetting connection.")
+            self.logger.error("Searching INBOX failed (error: " + str(e) + "). Resetting connection.")
             self.connection = None
-        return mail_infos
+        return None
 
     @staticmethod
-    def _find_emails_to_download(cache_info: dict, mail_infos: list):
-        email_uids_to_download = set()
-        cache_without_extensions = [os.path.splitext(entry)[0] for entry in cache_info]
+    def _find_emails_to_download(cache_info: list, mail_infos: list) -> dict:
+        """ Returns the mail info entries of all attachments not in the cache yet, grouped by e-mail uid."""
+        email_infos_to_download = {}
+        cache_without_extensions = {os.path.splitext(entry)[0] for entry in cache_info}
         for entry in mail_infos:
             if entry["mangled_name"] not in cache_without_extensions:
-                email_uids_to_download.add(entry["email_uid"])
-        return email_uids_to_download
-
-    def _download_email_attachments(self, email_uids, cache_path: str):
-        self.logger.info("Downloading {} new e-mail(s) from server.".format(len(email_uids)))
-        for email_uid in email_uids:
-            email_info = self._mail_info(email_uid)[0]
-            _, data = self.connection.fetch(email_uid, "(BODY.PEEK[])")
-            email_body = data[0][1]
-            mail = email.message_from_string(email_body.decode("utf-8"))
-            if mail.get_content_maintype() != 'multipart':
-                self.logger.error("Requested to download e-mail {}, but is not of type 'multipart'".format(email_uid))
-                continue
+                email_infos_to_download.setdefault(entry["email_uid"], []).append(entry)
+        return email_infos_to_download
+
+    @staticmethod
+    def _write_base64(data: bytes, attachment_fh):
+        """ Decode base64 data slice by slice. Each slice is decoded in whole groups of 4 characters,
+        the rest is decoded with the next slice: line lengths of the encoded data need not be a multiple of 4."""
+        pending = b""
+        for start in range(0, len(data), WRITE_BUFFER_SIZE):
+            encoded = pending + data[start:start + WRITE_BUFFER_SIZE].translate(None, _BASE64_IGNORED)
+            complete = len(encoded) - len(encoded) % 4
+            attachment_fh.write(binascii.a2b_base64(encoded[:complete]))
+            pending = encoded[complete:]
+        if pending:
+            attachment_fh.write(binascii.a2b_base64(pending))  # incomplete last group, raises binascii.Error
+
+    @staticmethod
+    def _write_attachment(data: bytes, encoding: str, file_path: str):
+        """ Decode the transfer encoding of the attachment data while writing it to file_path.
+        The data is written to a temporary file first: a failed download must not look like a cached file."""
+        temp_path = file_path + ".tmp"
+        try:
+            with open(temp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as attachment_fh:
+                if encoding == "base64":
+                    AttachmentFetcher._write_base64(data, attachment_fh)
+                elif encoding == "quoted-printable":
+                    quopri.decode(io.BytesIO(data), attachment_fh)
+                else:
+                    attachment_fh.write(data)  # 7bit, 8bit and binary parts are not encoded
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def _download_email_attachments(self, email_infos: dict, cache_path: str):
+        """ Download only the attachment parts of the given e-mails, not the complete messages.
+        email_infos maps the e-mail uids to the mail info entries of the attachments to download.
+        Date and sender are taken from these entries, they are not fetched again."""
+        self.logger.info("Downloading {} new e-mail(s) from server.".format(len(email_infos)))
+        # e-mails with attachments in the same sections can be fetched together
+        uids_by_sections = {}
+        for email_uid in sorted(email_infos, key=int):
+            sections = tuple(entry["section"] for entry in email_infos[email_uid])
+            uids_by_sections.setdefault(sections, []).append(email_uid)
+
+        missing_attachments = 0
+        for sections, uids in uids_by_sections.items():
+            fetch_items = "(" + " ".join("BODY.PEEK[{}]".format(section) for section in sections) + ")"
+            # many large attachments are split over several FETCH commands, to limit the memory use
+            sizes = [sum(entry["size"] for entry in email_infos[email_uid]) for email_uid in uids]
+            for uid_chunk in self._chunks_by_size(uids, sizes, FETCH_MAX_BYTES, FETCH_CHUNK_SIZE):
+                response_code, data = self.connection.uid('FETCH', b",".join(uid_chunk), fetch_items)
+                if response_code != "OK":
+                    raise imaplib.IMAP4.error("Downloading {} e-mail(s) failed.".format(len(uid_chunk)))
 
-            for part in mail.walk():
-                if part.get_content_maintype() == 'multipart' or part.get('Content-Disposition') is None:
-                    continue
-                # validity of a file-name needs to be re-checked because an e-mail may contain valid and invalid attachments
-                # validity of the sender does NOT need to be re-checked (only valid sender e-mails in uid list)
-                if part.get_filename() is None or not self._is_valid_file(part.get_filename()):
-                    continue
-                # found a valid attachment, let's download it
-                self.logger.info("Downloading file {}".format(part.get_filename()))
-                output_name = self._unique_attachment_name(
-                    email_info["email_datetime"], email_info["email_from"], part.get_filename())
-                extension = os.path.splitext(part.get_filename())[1].lower()
-                open(os.path.join(cache_path, output_name + extension), 'wb').write(part.get_payload(decode=True))
-
-    def _update_cache_txt_file(self):
+                # literals by uid. the response may contain several FETCH items per e-mail, e.g. unsolicited flag updates
+                literals_by_uid = {}
+                for email_uid, _, literals in self._split_fetch_response(data):
+                    literals_by_uid.setdefault(email_uid, {}).update(literals)
+
+                for email_uid in uid_chunk:
+                    literals = literals_by_uid.get(email_uid, {})
+                    for email_info in email_infos[email_uid]:
+                        attachment_data = literals.get("BODY[{}]".format(email_info["section"]).encode("ascii"))
+                        if attachment_data is None:
+                            self.logger.error("Did not receive attachment {} of e-mail {}".format(
+                                email_info["attachment_name"], email_uid.decode("ascii")))
+                            missing_attachments += 1
+                            continue
+                        # found a valid attachment (file name and sender are checked in _mail_info), let's save it
+                        self.logger.info("Downloading file {}".format(email_info["attachment_name"]))
+                        output_name = email_info["mangled_name"]
+                        extension = os.path.splitext(email_info["attachment_name"])[1].lower()
+                        self._write_attachment(
+                            attachment_data, email_info["encoding"], os.path.join(cache_path, output_name + extension))
+                        self._add_to_cache(output_name + extension)
+
+        # the sync state must not advance past e-mails with attachments that were not received, retry them next time
+        if missing_attachments > 0:
+            raise imaplib.IMAP4.error("Did not receive {} attachment(s).".format(missing_attachments))
+
+    def _read_sync_state(self) -> dict:
+        """ Read the mailbox state of the last successful update from the header lines of the cache info file."""
+        sync_state = {}
+        if not os.path.isfile(self.cache_info_file):
+            return sync_state
+        with open(self.cache_info_file, "r") as cache_txt_fh:
+            for line in cache_txt_fh:
+                if not line.startswith("# "):
+                    break
+                key, _, value = line[2:].strip().partition("=")
+                sync_state[key] = value
+        return sync_state
+
+    def _search_filter(self) -> str:
+        """ Fingerprint of the allowed file extensions and senders, stored with the sync state."""
+        search_filter = "\n".join(sorted(self.allowed_file_extensions)) + "\n\n" + "\n".join(sorted(self.allowed_senders))
+        return hashlib.sha256(search_filter.encode("utf-8")).hexdigest()[:16]
+
+    def _first_uid_to_search(self, sync_state: dict, cached_list: list) -> int:
+        """ Only e-mails received since the last successful update need to be searched, as long as the
+        mailbox was not rebuilt on the server (changed UIDVALIDITY), the allowed file extensions and senders
+        did not change and the cache is not empty."""
+        last_uidnext = sync_state.get("last_uidnext", "")
+        if not cached_list or not last_uidnext.isdigit():
+            return 1
+        if self.uidvalidity is None or sync_state.get("uidvalidity") != self.uidvalidity:
+            self.logger.info("UIDVALIDITY of INBOX changed, searching all E-Mails.")
+            return 1
+        if sync_state.get("search_filter") != self._search_filter():
+            # older e-mails may match the changed configuration
+            self.logger.info("Allowed file extensions or senders changed, searching all E-Mails.")
+            return 1
+        return int(last_uidnext)
+
+    def _update_cache_txt_file(self, sync_state: dict):
         cached_list = self._get_cache()
         with open(self.cache_info_file, "w") as cache_txt_fh:
+            for key, value in sync_state.items():
+                cache_txt_fh.write("# {}={}\n".format(key, value))
             for file in cached_list:
                 cache_txt_fh.write(os.path.join(self.cache_data_path, file) + "\n")
         
     def _update_cache(self) -> bool:
         cached_list = self._get_cache()
-        self._open_connection()
-        self._select_inbox()
-        mail_infos = self._search_all()
-        new_attachments_found = False
+        sync_state = self._read_sync_state()
+        self.connect()
+        mail_infos = None
+        if self.connection is not None:
+            mail_infos = self._search_all(self._first_uid_to_search(sync_state, cached_list))
+        # attachments are added to the cache as soon as they are written, also if downloading others fails later on
+        cached_count = len(cached_list)
 
         try:
-            email_uids_to_download = self._find_emails_to_download(cached_list, mail_infos)
-            self._download_email_attachments(email_uids_to_download, self.cache_data_path)
-            new_attachments_found = len(email_uids_to_download) > 0
+            if mail_infos is not None:
+                email_infos_to_download = self._find_emails_to_download(cached_list, mail_infos)
+                self._download_email_attachments(email_infos_to_download, self.cache_data_path)
+                # everything up to now is in the cache, next time search only e-mails received afterwards
+                if self.uidnext is not None and self.uidvalidity is not None:
+                    sync_state = {
+                        "last_uidnext": self.uidnext,
+                        "uidvalidity": self.uidvalidity,
+                        "search_filter": self._search_filter()}
         except Exception as e:
             self.logger.error("Failed to download new E-Mail attachments. Error was: {}".format(str(e)))
-        self._update_cache_txt_file()
+        self._update_cache_txt_file(sync_state)
 
+        new_attachments_found = len(self._get_cache()) > cached_count
         return new_attachments_found
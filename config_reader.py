@@ -3,6 +3,7 @@
 import configparser
 import logging
 import os
+import pickle
 
 # default configuration template to fill
 config_template_lines = [
@@ -86,22 +87,12 @@ class ConfigData:
         self.imap_data = ImapData()
         self.attachment_data = AttachmentData()
 
-    def set_general_data(
-        self, number_of_images_to_show: str, delay_display_minutes: str, delay_update_minutes: str,
-        screen_brightness: str, start_black_screen_hour: str, stop_black_screen_hour: str):
-        """ set integer values if the strings are suitable, otherwise keep default values"""
-        if number_of_images_to_show.isdigit():
-            self.general_data.number_of_images_to_show = int(number_of_images_to_show)
-        if delay_display_minutes.isdigit():
-            self.general_data.delay_display_minutes = int(delay_display_minutes)
-        if delay_update_minutes.isdigit():
-            self.general_data.delay_update_minutes = int(delay_update_minutes)
-        if screen_brightness.isdigit():
-            self.general_data.screen_brightness = int(screen_brightness)
-        if start_black_screen_hour.isdigit():
-            self.general_data.start_black_screen_hour = int(start_black_screen_hour)
-        if stop_black_screen_hour.isdigit():
-            self.general_data.stop_black_screen_hour = int(stop_black_screen_hour)
+    def set_general_data(self, **general_values: str):
+        """ set integer values of known fields if the strings are suitable, otherwise keep default values"""
+        known_fields = vars(self.general_data)
+        for field, value in general_values.items():
+            if field in known_fields and value.isdigit():
+                setattr(self.general_data, field, int(value))
 
     def set_imap_data(self, host: str, port: str, user: str, passwd: str):
         self.imap_data = ImapData(host=host, port=port, user=user, passwd=passwd)
@@ -116,6 +107,7 @@ class ConfigData:
 class ConfigReader:
     def __init__(self, config_file_path, logger: logging.Logger):
         self.config_file_path = config_file_path
+        self.config_cache_path = os.path.splitext(config_file_path)[0] + ".cache.pkl"
         self.logger = logger
         self.config_data = ConfigData()
 
@@ -133,17 +125,18 @@ class ConfigReader:
             self.logger.error("Created empty config template {}. Please update it.".format(self.config_file_path))
             return ConfigData()
 
+        config_mtime = os.stat(self.config_file_path).st_mtime_ns
+        cached_config_data = self._load_cached_config(config_mtime)
+        if cached_config_data is not None:
+            self.config_data = cached_config_data
+            return self.config_data
+
         try:
             config = configparser.ConfigParser()
             config.read(self.config_file_path)
 
             self.config_data.set_general_data(
-                number_of_images_to_show=config.get('general', 'number_of_images_to_show').strip(),
-                delay_display_minutes=config.get('general', 'delay_display_minutes').strip(),
-                delay_update_minutes=config.get('general', 'delay_update_minutes').strip(),
-                screen_brightness=config.get('general', 'screen_brightness').strip(),
-                start_black_screen_hour=config.get('general', 'start_black_screen_hour').strip(),
-                stop_black_screen_hour=config.get('general', 'stop_black_screen_hour').strip())
+                **{field: value.strip() for field, value in config.items('general')})
 
             self.config_data.set_imap_data(
                 host=config.get('imap', 'hostname').strip(),
@@ -152,13 +145,42 @@ class ConfigReader:
                 passwd=config.get('imap', 'password').strip())
 
             self.config_data.set_attachment_data(
-                tuple(entry.strip().lower() for entry in config.get('attachments', 'allowed_image_extensions').split(",")),
-                tuple(entry.strip().lower() for entry in config.get('attachments', 'wifi_config_extension').split(",")),
-                tuple(entry.strip()         for entry in config.get('attachments', 'wifi_config_allowed_senders').split(",")))
+                tuple(map(str.lower, map(str.strip, config.get('attachments', 'allowed_image_extensions').split(",")))),
+                tuple(map(str.lower, map(str.strip, config.get('attachments', 'wifi_config_extension').split(",")))),
+                tuple(map(str.strip, config.get('attachments', 'wifi_config_allowed_senders').split(","))))
 
         except Exception as e:
             self.logger.error("Could not load one or more required fields from {}".format(self.config_file_path))
             self.logger.error("Error was: " + str(e))
             return ConfigData()
 
+        self._store_cached_config(config_mtime)
         return self.config_data
+
+    def _load_cached_config(self, config_mtime: int):
+        """ Return the config data parsed on a previous run, if the config file has not been modified since."""
+        if not os.path.isfile(self.config_cache_path):
+            return None
+        try:
+            with open(self.config_cache_path, "rb") as cache_fh:
+                cached_mtime, cached_config_data = pickle.load(cache_fh)
+        except Exception as e:
+            self.logger.warning("Could not load cached config {} (error: {})".format(self.config_cache_path, str(e)))
+            return None
+        if cached_mtime != config_mtime or not isinstance(cached_config_data, ConfigData):
+            return None
+        return cached_config_data
+
+    def _store_cached_config(self, config_mtime: int):
+        """ The cache contains the imap password: it is readable by the owner only, like the config file should be.
+        Written to a temporary file and renamed, a broken cache file is never loaded."""
+        temp_path = self.config_cache_path + ".tmp"
+        try:
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as cache_fh:
+                pickle.dump((config_mtime, self.config_data), cache_fh)
+            os.replace(temp_path, self.config_cache_path)
+        except Exception as e:
+            self.logger.warning("Could not write cached config {} (error: {})".format(self.config_cache_path, str(e)))
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import crontab
 import datetime
 import logging
 import os
-import psutil
 import subprocess
 import time
 
@@ -26,10 +26,10 @@ class FamilyPiFrame:
         self.app_data_path = app_data_path
         self.wpa_supplicant_config = wpa_supplicant_config
 
-        self.image_cache_data_path = os.path.join(app_data_path, "cache"),
+        self.image_cache_data_path = os.path.join(app_data_path, "cache")
         self.image_cache_info_file = os.path.join(self.app_data_path, "cache.txt")
 
-        self.wifi_cache_data_path = os.path.join(app_data_path, "wifi_cache"),
+        self.wifi_cache_data_path = os.path.join(app_data_path, "wifi_cache")
         self.wifi_cache_info_file = os.path.join(self.app_data_path, "wifi_cache.txt")
 
         self.config_file_path = os.path.join(app_data_path, "config.ini")
@@ -39,7 +39,7 @@ class FamilyPiFrame:
 
         self.config_data = None
 
-    def run(self):
+    def run(self, update_cron: bool = True):
         run_locker = Locker(self.app_data_path, timeout_minutes=30.0)
         if not run_locker.request(self.logger):
             self.logger.info("[status] Requesting lock not successful, stopping.")
@@ -48,23 +48,31 @@ class FamilyPiFrame:
         self.logger.info("[status] reading config")
         self.config_data = ConfigReader(self.config_file_path, self.logger).read_config()
 
-        self.logger.info("[status] fetching new images")
-        new_images_available = AttachmentFetcher(
+        self.logger.info("[status] fetching new images and wifi data")
+        image_fetcher = AttachmentFetcher(
             self.image_cache_data_path,
             self.image_cache_info_file,
             self.config_data.imap_data,
             self.config_data.attachment_data.allowed_image_extensions,
             ["*"],  # allow all senders for images currently
-            self.logger).run()
-
-        self.logger.info("[status] fetching new wifi data")
-        new_wifi_data_available = AttachmentFetcher(
+            self.logger)
+        wifi_fetcher = AttachmentFetcher(
             self.wifi_cache_data_path,
             self.wifi_cache_info_file,
             self.config_data.imap_data,
             self.config_data.attachment_data.wifi_config_extension,
             self.config_data.attachment_data.wifi_config_allowed_senders,
-            self.logger).run()
+            self.logger)
+
+        # both fetchers run concurrently. imap connections do not support concurrent commands,
+        # so each fetcher opens its own connection
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            new_images_future = executor.submit(image_fetcher.run)
+            new_wifi_data_future = executor.submit(wifi_fetcher.run)
+            new_images_available = new_images_future.result()
+            new_wifi_data_available = new_wifi_data_future.result()
+        image_fetcher.disconnect()
+        wifi_fetcher.disconnect()
 
         if new_wifi_data_available:
             self._call_wpa_supplicant_config_update()
@@ -75,8 +83,9 @@ class FamilyPiFrame:
             time.sleep(2)  # make sure the process is closed before continuing
             startup_delay = 2  # need less delay, we are not in startup mode
         if not self._find_process("sxiv"):
-            self.logger.info("[status] updating cron")
-            self._update_cron()
+            if update_cron:
+                self.logger.info("[status] updating cron")
+                self._update_cron()
             self.logger.info("[status] Starting display process")
             time.sleep(startup_delay)
             self._start_display()
@@ -87,6 +96,20 @@ class FamilyPiFrame:
 
         run_locker.release()
 
+    def run_forever(self):
+        """
+        Alternative to the cronjob: repeat the cron cycle in this process, waiting delay_update_minutes
+        in between. Saves the interpreter startup and module imports of every cron cycle.
+        The cronjob is not updated in this mode, it would start additional processes.
+        """
+        while True:
+            try:
+                self.run(update_cron=False)
+            except Exception as e:
+                self.logger.error("Cycle failed with error: " + str(e))
+            delay_update_minutes = self.config_data.general_data.delay_update_minutes if self.config_data else 3
+            time.sleep(delay_update_minutes * 60)
+
     #############################################
     # private functions of FamilyPiFrame
     #############################################
@@ -106,8 +129,14 @@ class FamilyPiFrame:
         else:
             self.logger.error("Could not open logging output file!")
 
-    def _execute_and_communicate(self, cmd_list: list, log: bool=True):
-        sub_out, sub_err = subprocess.Popen(" ".join(cmd_list), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    def _execute_and_communicate(self, cmd_list: list, log: bool=True, shell: bool=False):
+        # without a shell the command is executed directly, saving the start of /bin/sh
+        cmd = " ".join(cmd_list) if shell else cmd_list
+        try:
+            sub_out, sub_err = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        except OSError as e:
+            self.logger.error("[error] Could not execute {} (error: {}).".format(" ".join(cmd_list), str(e)))
+            return
         if log:
             self.logger.info("[status] executed " + " ".join(cmd_list))
             for out_entry in sub_out.decode("utf-8").strip().split("\n"):
@@ -130,6 +159,8 @@ class FamilyPiFrame:
             entries = sorted(cache_txt_fh.readlines(), reverse=True)
             count = 0
             for entry in entries:
+                if entry.startswith("#"):
+                    continue  # header lines with the mailbox state of the last update
                 if count >= self.config_data.general_data.number_of_images_to_show:
                     break
                 cache_image_list.append(entry.strip())
@@ -142,37 +173,33 @@ class FamilyPiFrame:
 
     @staticmethod
     def _find_process(proc_name: str):
-        for proc in psutil.process_iter():
-            try:
-                if proc_name.lower() in proc.name().lower():
-                    return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        return False
+        # pgrep exits with 0 if at least one process with exactly this name is running
+        return subprocess.run(["pgrep", "-x", proc_name], stdout=subprocess.DEVNULL).returncode == 0
 
     def _kill_process(self, proc_name: str):
-        for proc in psutil.process_iter():
-            try:
-                if proc_name.lower() in proc.name().lower():
-                    proc.kill()
-                    return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                self.logger.warn("Failed to kill process.")
-
+        returncode = subprocess.run(["pkill", "-KILL", "-x", proc_name], stderr=subprocess.DEVNULL).returncode
+        if returncode == 0:
+            return True
+        # pkill exits with 1 if no process matched: nothing to kill, no failure
+        if returncode != 1:
+            self.logger.warning("Failed to kill process.")
         return False
 
     def _set_sxiv_background_black(self):
+        # marker file in the app data folder, set as soon as ~/.Xresources is known to contain the config
+        configured_marker = os.path.join(self.app_data_path, ".xresources_configured")
+        if os.path.exists(configured_marker):
+            return
         try:
             black_background_string = "Sxiv.background: #000000"
             target_config_file = os.path.expanduser("~/.Xresources")
 
-            if os.path.isfile(target_config_file) and black_background_string in open(target_config_file).read():
-                return
-
-            self.logger.info("Adding black background config for sxiv in " + target_config_file)
-            config_fh = open(target_config_file, "a+")
-            config_fh.write("\n" + black_background_string + "\n")
-            config_fh.close()
+            if not os.path.isfile(target_config_file) or black_background_string not in open(target_config_file).read():
+                self.logger.info("Adding black background config for sxiv in " + target_config_file)
+                config_fh = open(target_config_file, "a+")
+                config_fh.write("\n" + black_background_string + "\n")
+                config_fh.close()
+            open(configured_marker, "w").close()
         except Exception as e:
             self.logger.warning("Could not set background to black for sxiv in ~/.Xresources. Is it accessible?")
             self.logger.warning("Error was: " + str(e))
@@ -189,7 +216,8 @@ class FamilyPiFrame:
 
         try:
             self.logger.info("Running " + " ".join(cmd_list))
-            subprocess.Popen(cmd_list, env=env_with_display, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # the output is never read: pipes would fill up and block the viewer, if this process keeps running
+            subprocess.Popen(cmd_list, env=env_with_display, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         except Exception as e:
             self.logger.error("Starting the sxiv viewer failed. Is it installed?")
             self.logger.error("Error was: " + str(e))
@@ -212,11 +240,12 @@ class FamilyPiFrame:
             str(self.config_data.general_data.is_black_screen_hour(current_hour))))
 
         if self.config_data.general_data.is_black_screen_hour(current_hour):
-            self._execute_and_communicate(["xset -d :0 s    0 0   && sleep 1 && xset -d :0 s off && sleep 1"], log=False)
-            self._execute_and_communicate(["xset -d :0 dpms 0 0 0 && sleep 1 && xset -d :0 -dpms && sleep 1"], log=False)
-            self._execute_and_communicate(["xrandr --output HDMI-1 --brightness 0"])
+            screen_brightness = "0"
         else:
-            screen_brightness_fraction = float(self.config_data.general_data.screen_brightness) / 100.0
-            self._execute_and_communicate(["xset -d :0 s    0 0   && sleep 1 && xset -d :0 s off && sleep 1"], log=False)
-            self._execute_and_communicate(["xset -d :0 dpms 0 0 0 && sleep 1 && xset -d :0 -dpms && sleep 1"], log=False)
-            self._execute_and_communicate(["xrandr --output HDMI-1 --brightness " + str(screen_brightness_fraction)])
+            screen_brightness = str(float(self.config_data.general_data.screen_brightness) / 100.0)
+        # disable screen saver and power saving, then set the brightness. all in a single shell call,
+        # the three groups are separated by ; so the brightness is set even if a xset call fails
+        self._execute_and_communicate([
+            "xset -d :0 s    0 0   && sleep 1 && xset -d :0 s off && sleep 1 ;",
+            "xset -d :0 dpms 0 0 0 && sleep 1 && xset -d :0 -dpms && sleep 1 ;",
+            "xrandr --output HDMI-1 --brightness " + screen_brightness], shell=True)
@@ -1,46 +1,74 @@
 #!/usr/bin/env python3
 
 import datetime
-import glob
 import logging
 import os
+import time
 
 class Locker:
     def __init__(self, base_folder, timeout_minutes=30.0):
         self.dt_format = "%Y-%m-%d_%H-%M-%S"
         self.base_folder = base_folder
-        self.current_time = datetime.datetime.now()
+        self.lockfile = os.path.join(base_folder, "run.lock")
         self.current_lockfile = None
+        self.current_token = None
         self.timeout_minutes = timeout_minutes
 
+    def _read_token(self):
+        """ Content of the lock file identifying the run holding it, None if there is no lock file."""
+        try:
+            with open(self.lockfile, "r") as lock_fh:
+                return lock_fh.read()
+        except FileNotFoundError:
+            return None
+
     def request(self, logger: logging.Logger) -> bool:
-        existing_locks = glob.glob(os.path.join(self.base_folder, "*.lock"))
-        valid_lock_active = False
-        for existing_lock in existing_locks:
-            if not os.path.isfile(existing_lock):
-                continue
-            lock_stamp = os.path.basename(existing_lock).split(".")[0]
-            lock_time = datetime.datetime.strptime(lock_stamp, self.dt_format)
-            lock_still_valid = (self.current_time - lock_time).total_seconds() < self.timeout_minutes * 60.0
-            if lock_still_valid:
-                logger.info("[status] Found valid lock from " + lock_stamp)
-                valid_lock_active = True
-            else:
-                logger.warning("[warning] Found too old lock file {}: Removing it.".format(existing_lock))
-                os.remove(existing_lock)
+        # identifies this run: a lock taken over by another run after timeout is not released by this one
+        token = "{} {}\n".format(os.getpid(), datetime.datetime.now().strftime(self.dt_format + ".%f"))
+        # second attempt only after removing a too old lock file
+        for _ in range(2):
+            try:
+                # O_EXCL makes creation fail if the lock file exists, atomically
+                lock_fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                try:
+                    os.write(lock_fd, token.encode("ascii"))
+                finally:
+                    os.close(lock_fd)
+                self.current_lockfile = self.lockfile
+                self.current_token = token
+                return True
+            except FileExistsError:
+                pass
 
-        if valid_lock_active:
-            return False
+            try:
+                lock_token = self._read_token()
+                lock_mtime = os.stat(self.lockfile).st_mtime
+            except FileNotFoundError:
+                continue  # lock was released in the meantime
+            lock_stamp = datetime.datetime.fromtimestamp(lock_mtime).strftime(self.dt_format)
+            if time.time() - lock_mtime < self.timeout_minutes * 60.0:
+                logger.info("[status] Found valid lock from " + lock_stamp)
+                return False
+            logger.warning("[warning] Found too old lock file {} from {}: Removing it.".format(self.lockfile, lock_stamp))
+            # another run may have replaced the too old lock file in the meantime, keep that one
+            if self._read_token() == lock_token:
+                try:
+                    os.remove(self.lockfile)
+                except FileNotFoundError:
+                    pass
 
-        self.current_lockfile = os.path.join(self.base_folder, self.current_time.strftime(self.dt_format) + ".lock")
-        open(self.current_lockfile, "w").close()
-        return True
+        return False
 
     def release(self):
         if self.current_lockfile is not None:
-            if os.path.isfile(self.current_lockfile):
-                os.remove(self.current_lockfile)
+            # only remove the lock file if it is still the one created by this run
+            if self._read_token() == self.current_token:
+                try:
+                    os.remove(self.current_lockfile)
+                except FileNotFoundError:
+                    pass
             self.current_lockfile = None
+            self.current_token = None
 
     def __del__(self):
         self.release()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 
 from family_piframe import FamilyPiFrame
 
@@ -10,13 +11,18 @@ from family_piframe import FamilyPiFrame
 # required additional Ubuntu packages:
 # - sxiv
 # - python3-crontab
-# - python3-psutil (should be already available)
+# - procps (pgrep/pkill, should be already available)
 # - libxext6 (should be already available)
 #
 # required cronjob:
 # - run "crontab -e" and paste
 #     SHELL=/bin/bash
 #     */3 * * * * export DISPLAY=:0 && /usr/bin/python3 /home/pi/zero-fun-net/family-piframe/main.py &> /home/pi/zero-fun-net/family-piframe/console.log &
+# - after installing or updating, precompile the sources once, so no cron cycle needs to compile them:
+#     python3 -m compileall /home/pi/zero-fun-net/family-piframe
+#
+# alternative to the cronjob: a single long-running process, started once (e.g. via @reboot cron entry)
+#     export DISPLAY=:0 && /usr/bin/python3 /home/pi/zero-fun-net/family-piframe/main.py --daemon &> /home/pi/zero-fun-net/family-piframe/console.log &
 #  
 # optional additional changes:
 # - hide trash icon from desktop: edit /etc/xdg/pcmanfm/LXDE-pi/desktop-items-0.conf (set show_trash=0)
@@ -27,15 +33,20 @@ from family_piframe import FamilyPiFrame
 def main(
     app_path_string: str,
     wpa_supplicant_config: str,
-    verbose: bool=True):
+    verbose: bool=True,
+    run_forever: bool=False):
 
     app_path = os.path.expanduser(app_path_string)
     family_pi_frame = FamilyPiFrame(app_path, wpa_supplicant_config, verbose)
-    family_pi_frame.run()
+    if run_forever:
+        family_pi_frame.run_forever()
+    else:
+        family_pi_frame.run()
 
 
 if __name__ == '__main__':
     app_home = "/home/pi/zero-fun-net/family-piframe"
     wpa_supplicant_config = "/etc/wpa_supplicant/wpa_supplicant.conf"
     verbose = False
-    main(app_home, wpa_supplicant_config, verbose)
+    run_forever = "--daemon" in sys.argv[1:]
+    main(app_home, wpa_supplicant_config, verbose, run_forever)
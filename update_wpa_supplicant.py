@@ -1,57 +1,147 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import os
-import pathlib
-import re
+import shutil
 import subprocess
 import sys
 
+_SSID_KEY = b"ssid="
+# characters allowed before the ssid key, like \\s in a regex
+_SSID_PRECEDING = b" \t\n\r\f\v"
+# quotes around ssid values, removed for unique names
+_SSID_QUOTES = b"\"\'"
+
+def read_wifi_file(path: str) -> bytes:
+    with open(path, "rb") as wifi_fh:
+        # binary mode skips text decoding, line endings are normalized like in text mode
+        return wifi_fh.read().replace(b"\r\n", b"\n")
+
+def find_ssids(data: bytes) -> list:
+    """ Raw values of ssid=... preceded by whitespace until end of line, found with bytes.find (memchr)."""
+    ssids = []
+    start = 0  # the preceding whitespace must not be part of the previous match
+    pos = data.find(_SSID_KEY)
+    while pos >= 0:
+        if pos <= start or data[pos - 1] not in _SSID_PRECEDING:
+            pos = data.find(_SSID_KEY, pos + 1)
+            continue
+        end = data.find(b"\n", pos + len(_SSID_KEY))
+        if end < 0:
+            break  # only complete lines count
+        ssids.append(data[pos + len(_SSID_KEY):end])
+        start = end + 1
+        pos = data.find(_SSID_KEY, start)
+    return ssids
+
 def get_unique_wifi_data(wifi_cache_path) -> list:
-    wifi_files = [os.path.join(wifi_cache_path, f) for f in os.listdir(wifi_cache_path)]
-    wifi_files = [f for f in wifi_files if os.path.isfile(f)]
-    wifi_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)  # reverse order to prefer newer files over older
-    wifi_ssids = []
+    # scandir knows the file type from the directory listing and caches the stat result per entry
+    with os.scandir(wifi_cache_path) as entries:
+        # one stat per file: the sort keys are materialized in the tuples, not looked up while sorting
+        wifi_entries = [(e.stat().st_mtime, e.inode(), e.path) for e in entries if e.is_file(follow_symlinks=False)]
+
+    # read all files in inode order first, this avoids random seeks on a cold SD card.
+    # reads release the GIL, so a few threads let the SD card serve several requests at once
+    paths_by_inode = [path for _, _, path in sorted(wifi_entries, key=lambda entry: entry[1])]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        wifi_file_contents = dict(zip(paths_by_inode, executor.map(read_wifi_file, paths_by_inode)))
+
+    wifi_entries.sort(reverse=True)  # reverse order to prefer newer files over older
+    wifi_files = [path for _, _, path in wifi_entries]
+    wifi_ssids = set()
     wifi_data = []
     for wifi_file in wifi_files:
-        with open(wifi_file) as wifi_fh:
-            wifi_file_content = wifi_fh.read()
-            ssids = re.findall(r'\sssid=(.*)\n', wifi_file_content)  # ssid=..., preceded by whitespace, until end of line
-            ssids = [ssid.strip("\"\'") for ssid in ssids]  # remove quotes for unique names
-            if ssids == [] or any([ssid in wifi_ssids for ssid in ssids]):
-                continue  # add only files that don't contain already present SSIDs
-            wifi_ssids += ssids
-            wifi_data.append(wifi_file_content)
-            print("Found new SSIDs " + str(ssids) + " in wifi cache.")
+        wifi_file_content = wifi_file_contents[wifi_file]
+        ssids = [ssid.strip(_SSID_QUOTES).decode("utf-8", errors="replace") for ssid in find_ssids(wifi_file_content)]
+        if not ssids or not wifi_ssids.isdisjoint(ssids):
+            continue  # add only files that don't contain already present SSIDs
+        wifi_ssids.update(ssids)
+        wifi_data.append(wifi_file_content)
+        print("Found new SSIDs " + str(ssids) + " in wifi cache.")
     print("Found {} wifi cache files with unique wifi data.".format(len(wifi_data)))
     return wifi_data
 
+def copy_file_to_fd(source_file: str, target_fd: int):
+    """ Copy the content of source_file to the file descriptor inside the kernel, without reading it into python."""
+    with open(source_file, "rb") as source_fh:
+        size = os.fstat(source_fh.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(target_fd, source_fh.fileno(), offset, size - offset)
+            if sent == 0:
+                break  # file got shorter in the meantime
+            offset += sent
+
+def write_to_fd(target_fd: int, data: bytes):
+    remaining = memoryview(data)
+    while remaining:
+        remaining = remaining[os.write(target_fd, remaining):]
+
+def read_wifi_cache_mtime(mtime_file: str) -> str:
+    """ Modification time of the wifi cache folder at the last successful update, empty if unknown."""
+    try:
+        with open(mtime_file, "r") as mtime_fh:
+            return mtime_fh.read().strip()
+    except OSError:
+        return ""
+
 def update_wpa_supplicant_config(wpa_supplicant_config: str, wifi_cache_path: str):
     target_file = wpa_supplicant_config
     original_file = wpa_supplicant_config + ".orig"
+    mtime_file = wpa_supplicant_config + ".cache_mtime"
 
-    if not os.path.isfile(target_file) and not os.path.isfile(original_file):
-        print("[error] The required file wpa_supplicant config file was not found. Not updating wifi data.")
+    try:
+        # a single open checks both existence of and write access to the target file
+        os.close(os.open(target_file, os.O_RDWR))
+    except FileNotFoundError:
+        if not os.path.isfile(original_file):
+            print("[error] The required file wpa_supplicant config file was not found. Not updating wifi data.")
+            return
+    except OSError:
+        print("[error] No write access to wpa_supplicant config file {}. Not updating wifi data.".format(target_file))
         return
-    if not os.access(target_file, os.W_OK) or not os.access(pathlib.Path(original_file).parent.absolute(), os.W_OK):
+    if not os.access(os.path.dirname(os.path.abspath(original_file)), os.W_OK):
         print("[error] No write access to wpa_supplicant config file {}. Not updating wifi data.".format(target_file))
+        return
+    # adding or removing wifi cache files changes the mtime of the folder. if unchanged, the config is up to date
+    wifi_cache_mtime = str(os.stat(wifi_cache_path).st_mtime_ns)
+    if os.path.isfile(target_file) and os.path.isfile(original_file) and read_wifi_cache_mtime(mtime_file) == wifi_cache_mtime:
+        print("[info] Wifi cache {} unchanged since last update. Not updating wifi data.".format(wifi_cache_path))
+        return
     if not os.path.isfile(original_file):
         print("[info] Making a backup of file {} to {}".format(target_file, original_file))
-        cmd_list = ["cp", target_file, original_file]
-        subprocess.Popen(" ".join(cmd_list), shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        shutil.copy2(target_file, original_file)
     
     # generate new target file from original file and cached wifi data
-    with open(original_file, "r") as source_fh:
-        source_data = source_fh.readlines()
-        with open(target_file, "w") as target_fh:
-            target_fh.writelines(source_data)
-            target_fh.write("\n# THE FOLLOWING NETWORKS WERE ADDED BY THE FAMILY-PIFRAME SCRIPT!\n")
-            for wifi_cache_content in get_unique_wifi_data(wifi_cache_path):
-                    target_fh.writelines("\n")
-                    target_fh.writelines(wifi_cache_content)
+    wifi_data = [b"\n# THE FOLLOWING NETWORKS WERE ADDED BY THE FAMILY-PIFRAME SCRIPT!\n"]
+    for wifi_cache_content in get_unique_wifi_data(wifi_cache_path):
+        wifi_data += [b"\n", wifi_cache_content]
+    # write to a temporary file and rename it, a crash mid-write must not leave a broken config
+    temp_file = target_file + ".tmp"
+    try:
+        # the config contains wifi passwords: readable by the owner only until the original mode is applied
+        target_fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            copy_file_to_fd(original_file, target_fd)
+            write_to_fd(target_fd, b"".join(wifi_data))
+            os.fsync(target_fd)
+        finally:
+            os.close(target_fd)
+        if os.path.isfile(target_file):
+            shutil.copymode(target_file, temp_file)
+        os.replace(temp_file, target_file)
+    finally:
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+    with open(mtime_file, "w") as mtime_fh:
+        mtime_fh.write(wifi_cache_mtime + "\n")
     
     # finally, update the config via cli
     cmd_list = ["wpa_cli", "-i", "wlan0", "reconfigure"]
-    subprocess.Popen(" ".join(cmd_list), shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    try:
+        subprocess.run(cmd_list, check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        print("[error] Could not run {} (error: {}).".format(" ".join(cmd_list), str(e)))
 
 
 if __name__ == "__main__":